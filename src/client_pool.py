@@ -0,0 +1,85 @@
+import importlib.util
+import os
+import threading
+
+import httpx
+from ai_sdk.providers.openai import OpenAIModel
+from openai import OpenAI
+
+from src.router import router
+from src.run.model import ClientConfig
+
+
+class PooledOpenAIModel(OpenAIModel):
+    def __init__(self, model: str, base_url: str | None, api_key: str | None):
+        self._model = model
+        self._default_kwargs = {}
+        self.base_url = base_url
+        self.api_key = api_key
+
+    @property
+    def _client(self):
+        return client_pool.get_client(self.base_url, self.api_key)
+
+
+class ClientPool:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.config = ClientConfig()
+        self._clients: dict[tuple[str | None, str | None], OpenAI] = {}
+        self._providers: dict[tuple[str | None, str | None, str], PooledOpenAIModel] = {}
+
+    def configure(self, config: ClientConfig):
+        if config.http2 and importlib.util.find_spec("h2") is None:
+            raise ValueError("ClientConfig(http2=True) requires the h2 package. Install it with `uv pip install h2`.")
+        with self._lock:
+            if config == self.config:
+                return
+            self.config = config
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._providers.clear()
+        for client in clients:
+            client.close()
+
+    def create_client(self, base_url: str | None, api_key: str | None):
+        timeout = httpx.Timeout(self.config.timeout, connect=self.config.connect_timeout)
+        http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=self.config.max_connections,
+                max_keepalive_connections=self.config.max_keepalive_connections,
+                keepalive_expiry=self.config.keepalive_expiry,
+            ),
+            timeout=timeout,
+            http2=self.config.http2,
+            event_hooks={"response": [lambda response: router.record_headers(base_url, api_key, response.headers)]},
+        )
+        return OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0, http_client=http_client)
+
+    def get_client(self, base_url: str | None, api_key: str | None):
+        with self._lock:
+            client = self._clients.get((base_url, api_key))
+            if client is None:
+                client = self._clients[(base_url, api_key)] = self.create_client(base_url, api_key)
+            return client
+
+    def get(self, model: str, base_url: str | None = None, api_key: str | None = None):
+        base_url = base_url or os.environ.get("OPENAI_BASE_URL")
+        api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        key = (base_url, api_key, model)
+        with self._lock:
+            provider = self._providers.get(key)
+            if provider is None:
+                provider = self._providers[key] = PooledOpenAIModel(model, base_url=base_url, api_key=api_key)
+            return provider
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._providers.clear()
+        for client in clients:
+            client.close()
+
+
+client_pool = ClientPool()
@@ -0,0 +1,88 @@
+import threading
+import time
+from dataclasses import replace
+
+from src.metrics import metrics
+from src.run.model import ConcurrencyConfig, ConcurrencyStats
+
+FAST_LATENCY_WEIGHT = 0.3
+SLOW_LATENCY_WEIGHT = 0.05
+
+
+class AIMDLimiter:
+    def __init__(self, route: str, config: ConcurrencyConfig):
+        self.route = route
+        self.config = config
+        self._condition = threading.Condition()
+        self._limit = float(config.initial_limit)
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._fast_latency: float | None = None
+        self._slow_latency: float | None = None
+        self.stats = ConcurrencyStats(limit=config.initial_limit, peak_limit=config.initial_limit)
+
+    def get_stats(self):
+        with self._condition:
+            return replace(self.stats)
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+        return time.monotonic()
+
+    def release(self, started: float, overloaded: bool):
+        now = time.monotonic()
+        latency = now - started
+        with self._condition:
+            self._in_flight -= 1
+            if not overloaded:
+                if self._fast_latency is None or self._slow_latency is None:
+                    self._fast_latency = self._slow_latency = latency
+                else:
+                    self._fast_latency += FAST_LATENCY_WEIGHT * (latency - self._fast_latency)
+                    self._slow_latency += SLOW_LATENCY_WEIGHT * (latency - self._slow_latency)
+                overloaded = self._fast_latency > self.config.latency_tolerance * self._slow_latency
+
+            if overloaded and started >= self._last_decrease:
+                self._limit = max(float(self.config.min_limit), self._limit * self.config.decrease_factor)
+                self._last_decrease = now
+                self._fast_latency = self._slow_latency
+                self.stats.decreases += 1
+            elif not overloaded:
+                self._limit = min(float(self.config.max_limit), self._limit + self.config.increase / self._limit)
+
+            self.stats.limit = int(self._limit)
+            self.stats.peak_limit = max(self.stats.peak_limit, self.stats.limit)
+            self._condition.notify_all()
+        metrics.set_concurrency_limit(self.route, self.stats.limit)
+
+
+class ConcurrencyController:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.config = ConcurrencyConfig()
+        self._limiters: dict[str, AIMDLimiter] = {}
+
+    def configure(self, config: ConcurrencyConfig):
+        with self._lock:
+            if config != self.config:
+                self.config = config
+                self._limiters.clear()
+
+    def get_limiter(self, route: str):
+        with self._lock:
+            limiter = self._limiters.get(route)
+            if limiter is None:
+                limiter = self._limiters[route] = AIMDLimiter(route, self.config)
+            return limiter
+
+    def get_stats(self, route: str):
+        return self.get_limiter(route).get_stats()
+
+    def get_max_workers(self, parallel: int):
+        return max(1, -(-self.config.max_limit // parallel))
+
+
+concurrency = ConcurrencyController()
@@ -0,0 +1,327 @@
+import datetime
+import json
+import threading
+import uuid
+from collections import deque
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+from src.cache import LRUCache
+from src.client_pool import client_pool
+from src.concurrency import concurrency
+from src.daemon.model import ExperimentInfo, ExperimentRequest
+from src.dataset.model import DatasetName
+from src.metrics import metrics
+from src.router import router
+from src.run.index import STREAM_DIR, Runner
+from src.run.model import ClientConfig, ConcurrencyConfig, EndpointConfig, LengthMultiplierResult, ModelConfig
+
+DEFAULT_PORT = 8765
+RESPONSE_CACHE_SIZE = 4096
+
+
+@dataclass
+class Cell:
+    model_config: ModelConfig
+    dataset_name: DatasetName
+    length_multiplier: int
+
+
+class Experiment:
+    def __init__(self, request: ExperimentRequest):
+        self.request = request
+        self.pending: deque[Cell] = deque(
+            Cell(model_config=model_config, dataset_name=dataset_name, length_multiplier=length_multiplier)
+            for model_config in request.model_configs
+            for dataset_name in request.dataset_names
+            for length_multiplier in request.length_multipliers
+        )
+        self.info = ExperimentInfo(id=uuid.uuid4().hex[:12], submitter=request.submitter, status="queued", cells_total=len(self.pending))
+        self.running = 0
+        self.finishing = False
+        self.cell_results: dict[str, dict[DatasetName, dict[int, LengthMultiplierResult]]] = {}
+        self.events: list[dict[str, Any]] = []
+
+    @property
+    def finished(self):
+        return self.info.status in ("completed", "failed")
+
+
+class Daemon:
+    def __init__(
+        self,
+        max_cells: int = 2,
+        budget_dollars: float | None = None,
+        cache_responses: bool = True,
+        response_cache_size: int = RESPONSE_CACHE_SIZE,
+        client_config: ClientConfig | None = None,
+        concurrency_config: ConcurrencyConfig | None = None,
+        endpoints: list[EndpointConfig] | None = None,
+    ):
+        self.runner = Runner()
+        if client_config:
+            client_pool.configure(client_config)
+        if concurrency_config:
+            concurrency.configure(concurrency_config)
+        if endpoints:
+            router.configure(endpoints)
+        if cache_responses:
+            self.runner.task_runner.response_cache = LRUCache(response_cache_size)
+        self.budget_dollars = budget_dollars
+        self.spent = 0.0
+        self.condition = threading.Condition()
+        self.experiments: dict[str, Experiment] = {}
+        self.queues: dict[str, deque[Experiment]] = {}
+        self.turns: deque[str] = deque()
+
+        for i in range(max_cells):
+            threading.Thread(target=self.work, name=f"cell-worker-{i}", daemon=True).start()
+
+    def emit(self, experiment: Experiment, event: str, **data: Any):
+        experiment.events.append({"event": event, "experiment_id": experiment.info.id, **data})
+        self.condition.notify_all()
+
+    def submit(self, request: ExperimentRequest):
+        experiment = Experiment(request)
+        with self.condition:
+            self.experiments[experiment.info.id] = experiment
+            if request.submitter not in self.queues:
+                self.queues[request.submitter] = deque()
+                self.turns.append(request.submitter)
+            self.queues[request.submitter].append(experiment)
+            for model_config in request.model_configs:
+                metrics.plan(str(model_config), len(request.dataset_names) * len(request.length_multipliers) * request.n * len(request.strategies))
+            self.emit(experiment, "queued", cells_total=experiment.info.cells_total)
+        return experiment
+
+    def next_cell(self):
+        for _ in range(len(self.turns)):
+            submitter = self.turns[0]
+            self.turns.rotate(-1)
+            queue = self.queues[submitter]
+            while queue and not queue[0].pending:
+                queue.popleft()
+            if queue:
+                experiment = queue[0]
+                experiment.running += 1
+                return experiment, experiment.pending.popleft()
+        return None
+
+    def claim_finish(self, experiment: Experiment):
+        if experiment.pending or experiment.running or experiment.finishing:
+            return False
+        experiment.finishing = True
+        return True
+
+    def enforce_budget(self):
+        if self.budget_dollars is None or self.spent < self.budget_dollars:
+            return []
+        exhausted: list[Experiment] = []
+        for experiment in self.experiments.values():
+            if experiment.pending:
+                for cell in experiment.pending:
+                    metrics.plan(str(cell.model_config), -experiment.request.n * len(experiment.request.strategies))
+                experiment.pending.clear()
+                experiment.info.error = f"Budget of ${self.budget_dollars:.2f} exhausted."
+                if self.claim_finish(experiment):
+                    exhausted.append(experiment)
+        return exhausted
+
+    def work(self):
+        while True:
+            with self.condition:
+                exhausted = self.enforce_budget()
+                job = None if exhausted else self.next_cell()
+                while job is None and not exhausted:
+                    self.condition.wait()
+                    exhausted = self.enforce_budget()
+                    job = None if exhausted else self.next_cell()
+                if job and job[0].info.status == "queued":
+                    job[0].info.status = "running"
+                    self.emit(job[0], "running")
+
+            for experiment in exhausted:
+                self.finish(experiment)
+            if job is None:
+                continue
+            experiment, cell = job
+
+            request = experiment.request
+            result: LengthMultiplierResult | None = None
+            try:
+                result = self.runner.run(
+                    model_config=cell.model_config,
+                    dataset_name=cell.dataset_name,
+                    strategies=request.strategies,
+                    n=request.n,
+                    length_multiplier=cell.length_multiplier,
+                    seed=request.seed,
+                    samples_per_prompt=request.samples_per_prompt,
+                    pack_size=request.pack_size,
+                    stream_path=STREAM_DIR / experiment.info.id / f"{uuid.uuid4().hex}.jsonl",
+                )
+            except Exception as e:
+                print(f"Error running {cell.dataset_name} with {cell.model_config} (m={cell.length_multiplier}): {e}")
+                metrics.plan(str(cell.model_config), -request.n * len(request.strategies))
+
+            with self.condition:
+                experiment.running -= 1
+                cell_info = {"model": str(cell.model_config), "dataset": cell.dataset_name, "length_multiplier": cell.length_multiplier}
+                if result:
+                    experiment.cell_results.setdefault(str(cell.model_config), {}).setdefault(cell.dataset_name, {})[cell.length_multiplier] = result
+                    experiment.info.cells_done += 1
+                    experiment.info.dollars += result.dollars
+                    experiment.info.cached_dollars += result.cached_dollars
+                    self.spent += result.dollars - result.cached_dollars
+                    self.emit(
+                        experiment,
+                        "cell",
+                        **cell_info,
+                        dollars=result.dollars,
+                        cached_dollars=result.cached_dollars,
+                        summary={k: asdict(v) for k, v in result.summary.items()},
+                    )
+                else:
+                    experiment.info.cells_failed += 1
+                    self.emit(experiment, "cell_failed", **cell_info)
+                done = self.claim_finish(experiment)
+
+            if done:
+                self.finish(experiment)
+
+    def finish(self, experiment: Experiment):
+        request = experiment.request
+        error: str | None = None
+        result_path: str | None = None
+        summary: dict[str, Any] | None = None
+        try:
+            batch_result = self.runner.build_batch_result(
+                model_configs=request.model_configs,
+                dataset_names=request.dataset_names,
+                strategies=request.strategies,
+                n=request.n,
+                length_multipliers=request.length_multipliers,
+                seed=request.seed,
+                cell_results=experiment.cell_results,
+                samples_per_prompt=request.samples_per_prompt,
+                pack_size=request.pack_size,
+            )
+            if batch_result:
+                name = f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{experiment.info.id}"
+                result_path = str(self.runner.save_batch_result(batch_result, name=name))
+                summary = {k: asdict(v) for k, v in batch_result.summary.items()}
+            else:
+                error = "No cells completed."
+            self.runner.remove_streams(STREAM_DIR / experiment.info.id)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}. Partial task results are kept in {STREAM_DIR / experiment.info.id}"
+
+        with self.condition:
+            experiment.info.result_path = result_path
+            experiment.info.error = experiment.info.error or error
+            if experiment.info.error:
+                experiment.info.status = "failed"
+                self.emit(experiment, "failed", error=experiment.info.error, result_path=result_path)
+            else:
+                experiment.info.status = "completed"
+                self.emit(
+                    experiment,
+                    "completed",
+                    result_path=result_path,
+                    dollars=experiment.info.dollars,
+                    cached_dollars=experiment.info.cached_dollars,
+                    summary=summary,
+                )
+
+    def serve(self, port: int):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def send_json(self, status: int, body: Any):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def get_experiment(self, experiment_id: str):
+                with daemon.condition:
+                    return daemon.experiments.get(experiment_id)
+
+            def do_POST(self):
+                if self.path != "/experiments":
+                    return self.send_json(404, {"error": "Not found."})
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                    request = ExperimentRequest.from_json(body)
+                except (ValueError, KeyError, TypeError) as e:
+                    return self.send_json(400, {"error": f"Invalid experiment: {e}"})
+                experiment = daemon.submit(request)
+                self.send_json(202, asdict(experiment.info))
+
+            def do_GET(self):
+                parts = [p for p in self.path.split("?")[0].split("/") if p]
+                if parts == ["metrics"]:
+                    data = metrics.render_prometheus().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                if parts == ["experiments"]:
+                    with daemon.condition:
+                        infos = [asdict(e.info) for e in daemon.experiments.values()]
+                    return self.send_json(200, infos)
+                if len(parts) < 2 or parts[0] != "experiments" or not (experiment := self.get_experiment(parts[1])):
+                    return self.send_json(404, {"error": "Not found."})
+                if len(parts) == 2:
+                    with daemon.condition:
+                        info = asdict(experiment.info)
+                    return self.send_json(200, info)
+                if parts[2:] == ["events"]:
+                    return self.stream_events(experiment)
+                if parts[2:] == ["result"] and experiment.info.result_path:
+                    with open(experiment.info.result_path, "rb") as f:
+                        data = f.read()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json; charset=utf-8")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                self.send_json(404, {"error": "Not found."})
+
+            def stream_events(self, experiment: Experiment):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+                self.end_headers()
+                index = 0
+                while True:
+                    with daemon.condition:
+                        while index >= len(experiment.events) and not experiment.finished:
+                            daemon.condition.wait()
+                        events = experiment.events[index:]
+                        index += len(events)
+                        finished = experiment.finished and index >= len(experiment.events)
+                    try:
+                        for event in events:
+                            self.wfile.write((json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8"))
+                        self.wfile.flush()
+                    except (BrokenPipeError, ConnectionResetError):
+                        return
+                    if finished:
+                        return
+
+            def log_message(self, format: str, *args: object):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        print(f"Experiment daemon listening on http://127.0.0.1:{server.server_port}")
+        return server
+
+
+if __name__ == "__main__":
+    Daemon(max_cells=2, budget_dollars=None, cache_responses=True).serve(port=DEFAULT_PORT).serve_forever()
@@ -0,0 +1,72 @@
+from dataclasses import dataclass
+from typing import Any, Literal
+
+from src.dataset.model import DATASET_NAMES, DatasetName
+from src.run.model import REASONINGS, HedgeConfig, ModelConfig
+from src.tokenizer import TOKENIZATION_STRATEGIES, TokenizationStrategy
+
+ExperimentStatus = Literal["queued", "running", "completed", "failed"]
+
+
+@dataclass
+class ExperimentRequest:
+    submitter: str
+    model_configs: list[ModelConfig]
+    dataset_names: list[DatasetName]
+    strategies: list[TokenizationStrategy]
+    n: int
+    length_multipliers: list[int]
+    seed: int
+    samples_per_prompt: int = 1
+    pack_size: int = 1
+
+    @staticmethod
+    def from_json(body: dict[str, Any]):
+        model_configs = [
+            ModelConfig(model=m["model"], reasoning=m.get("reasoning"), hedge=HedgeConfig(**m["hedge"]) if m.get("hedge") else None)
+            for m in body["model_configs"]
+        ]
+        for model_config in model_configs:
+            if model_config.reasoning not in REASONINGS:
+                raise ValueError(f"Unknown reasoning: {model_config.reasoning}")
+        for dataset_name in body["dataset_names"]:
+            if dataset_name not in DATASET_NAMES:
+                raise ValueError(f"Unknown dataset: {dataset_name}")
+        strategies = body.get("strategies", TOKENIZATION_STRATEGIES)
+        for strategy in strategies:
+            if strategy not in TOKENIZATION_STRATEGIES:
+                raise ValueError(f"Unknown strategy: {strategy}")
+        if "baseline" not in strategies:
+            raise ValueError("strategies must include baseline.")
+        samples_per_prompt = int(body.get("samples_per_prompt", 1))
+        if samples_per_prompt < 1:
+            raise ValueError("samples_per_prompt must be at least 1.")
+        pack_size = int(body.get("pack_size", 1))
+        if pack_size < 1:
+            raise ValueError("pack_size must be at least 1.")
+
+        return ExperimentRequest(
+            submitter=str(body.get("submitter", "anonymous")),
+            model_configs=model_configs,
+            dataset_names=body["dataset_names"],
+            strategies=strategies,
+            n=int(body["n"]),
+            length_multipliers=[int(m) for m in body["length_multipliers"]],
+            seed=int(body.get("seed", 0)),
+            samples_per_prompt=samples_per_prompt,
+            pack_size=pack_size,
+        )
+
+
+@dataclass
+class ExperimentInfo:
+    id: str
+    submitter: str
+    status: ExperimentStatus
+    cells_total: int
+    cells_done: int = 0
+    cells_failed: int = 0
+    dollars: float = 0.0
+    cached_dollars: float = 0.0
+    result_path: str | None = None
+    error: str | None = None
@@ -15,8 +15,8 @@ DEFAULT_NUM_SAMPLES = 500
 TARGET_CHARS = ["が", "は", "を", "に", "の", "も", "た", "て", "だ", "る", "。", "、", "日", "本", "学", "者"]
 
 
-def get_char_count_output_file(length_multiplier: int):
-    return DATA_DIR / f"test_m{length_multiplier}.jsonl"
+def get_char_count_output_file(length_multiplier: int, seed: int):
+    return DATA_DIR / f"test_m{length_multiplier}_s{seed}.jsonl"
 
 
 def generate_char_count_dataset(n_samples: int, target_length: int, length_variance: float, target_chars: list[str], output_file: Path, seed: int):
@@ -79,7 +79,7 @@ def prepare_char_count(length_multiplier: int, seed: int):
     if length_multiplier < 1:
         raise ValueError("length_multiplier must be an integer >= 1.")
 
-    output_file = get_char_count_output_file(length_multiplier)
+    output_file = get_char_count_output_file(length_multiplier, seed)
     if not output_file.exists():
         print("Generating CharCount dataset from JWTD...")
         generate_char_count_dataset(
@@ -11,6 +11,7 @@ from dotenv import load_dotenv
 from src.dataset.char_count import get_char_count_output_file, prepare_char_count
 from src.dataset.jwtd import prepare_jwtd
 from src.dataset.model import JNLI, CharCount, DatasetConfig, DatasetName, JCommonsenseQA, JSQuADT, WikipediaTypo
+from src.dataset.snapshot import load_snapshot
 from src.task.model import Task
 
 load_dotenv()
@@ -20,9 +21,12 @@ os.environ["HF_DATASETS_TRUST_REMOTE_CODE"] = "1"
 
 
 class DatasetLoader:
-    def __init__(self, length_multiplier: int, seed: int):
+    def __init__(self, length_multiplier: int, seed: int, use_snapshot: bool = True):
         if length_multiplier < 1:
             raise ValueError("length_multiplier must be an integer >= 1.")
+        self.length_multiplier = length_multiplier
+        self.seed = seed
+        self.use_snapshot = use_snapshot
         self.configs: dict[DatasetName, DatasetConfig[Any]] = {
             "JCommonsenseQA": DatasetConfig[JCommonsenseQA](
                 path="shunk031/JGLUE",
@@ -68,7 +72,7 @@ class DatasetLoader:
             ),
             "CharCount": DatasetConfig[CharCount](
                 path="json",
-                name=str(get_char_count_output_file(length_multiplier)),
+                name=str(get_char_count_output_file(length_multiplier, seed)),
                 prepare=lambda: prepare_char_count(length_multiplier, seed),
                 transform=lambda r: Task(
                     id=r["id"], type="char_counting", context=r["text"], question=r["character"], options=[], ground_truths=[r["count"]]
@@ -77,6 +81,11 @@ class DatasetLoader:
         }
 
     def load_raw(self, dataset_name: DatasetName):
+        if self.use_snapshot:
+            snapshot = load_snapshot(dataset_name, self.length_multiplier, self.seed)
+            if snapshot is not None:
+                return snapshot
+
         config = self.configs[dataset_name]
         if config.prepare:
             config.prepare()
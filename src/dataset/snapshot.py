@@ -0,0 +1,85 @@
+import datetime
+import hashlib
+import json
+from pathlib import Path
+
+import pyarrow as pa
+from datasets.arrow_dataset import Dataset
+
+from src.dataset.model import DATASET_NAMES, DatasetName
+
+SNAPSHOT_DIR = Path("data/snapshots")
+MANIFEST_FILE = SNAPSHOT_DIR / "manifest.json"
+MANIFEST_VERSION = 1
+
+_verified_files: set[Path] = set()
+
+
+def get_snapshot_key(dataset_name: DatasetName, length_multiplier: int, seed: int):
+    return f"{dataset_name}_m{length_multiplier}_s{seed}" if dataset_name == "CharCount" else dataset_name
+
+
+def compute_sha256(path: Path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_manifest() -> dict[str, dict[str, str | int]]:
+    if not MANIFEST_FILE.exists():
+        return {}
+    with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"Unsupported snapshot manifest version in {MANIFEST_FILE}: {manifest.get('version')}")
+    return manifest["files"]
+
+
+def write_table(table: pa.Table, path: Path):
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def load_snapshot(dataset_name: DatasetName, length_multiplier: int, seed: int):
+    entry = read_manifest().get(get_snapshot_key(dataset_name, length_multiplier, seed))
+    if entry is None:
+        return None
+
+    path = SNAPSHOT_DIR / str(entry["file"])
+    if path not in _verified_files:
+        if compute_sha256(path) != entry["sha256"]:
+            raise ValueError(f"Checksum mismatch for snapshot {path}. Recreate it with src/dataset/snapshot.py.")
+        _verified_files.add(path)
+    return Dataset.from_file(str(path), in_memory=False)
+
+
+def create_snapshot(length_multipliers: list[int], seed: int):
+    from src.dataset.index import DatasetLoader
+
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    files = read_manifest()
+
+    for dataset_name in DATASET_NAMES:
+        for length_multiplier in length_multipliers if dataset_name == "CharCount" else length_multipliers[:1]:
+            key = get_snapshot_key(dataset_name, length_multiplier, seed)
+            print(f"Snapshotting {key}...")
+            raw = DatasetLoader(length_multiplier=length_multiplier, seed=seed, use_snapshot=False).load_raw(dataset_name)
+            table = raw.data.table if isinstance(raw, Dataset) else pa.Table.from_pylist(raw)
+            path = SNAPSHOT_DIR / f"{key}.arrow"
+            write_table(table, path)
+            files[key] = {"file": path.name, "sha256": compute_sha256(path), "num_rows": table.num_rows}
+
+    with open(MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(
+            {"version": MANIFEST_VERSION, "created_at": datetime.datetime.now().isoformat(), "files": files},
+            f,
+            indent=4,
+            ensure_ascii=False,
+        )
+    print(f"Snapshot manifest written to {MANIFEST_FILE}")
+
+
+if __name__ == "__main__":
+    create_snapshot(length_multipliers=[1, 5, 10], seed=0)
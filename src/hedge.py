@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import replace
+from typing import Callable, TypeVar
+
+from src.concurrency import concurrency
+from src.run.model import HedgeStats, ModelConfig
+
+T = TypeVar("T")
+
+
+class Hedger:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._executor: ThreadPoolExecutor | None = None
+        self._max_workers = 0
+        self._latencies: dict[str, list[float]] = defaultdict(list)
+        self._stats: dict[str, HedgeStats] = defaultdict(HedgeStats)
+
+    def reset(self):
+        with self._condition:
+            self._latencies.clear()
+            self._stats = defaultdict(HedgeStats, {k: HedgeStats(pending=s.pending) for k, s in self._stats.items() if s.pending})
+
+    def get_stats(self, key: str):
+        with self._condition:
+            return replace(self._stats[key])
+
+    def settle(self, key: str):
+        with self._condition:
+            self._condition.wait_for(lambda: self._stats[key].pending == 0)
+            return replace(self._stats[key])
+
+    def get_executor(self):
+        max_workers = 2 * concurrency.config.max_limit
+        with self._condition:
+            if self._executor is None or self._max_workers != max_workers:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+                self._max_workers = max_workers
+            return self._executor
+
+    def get_threshold(self, key: str, percentile: float, min_samples: int):
+        with self._condition:
+            latencies = sorted(self._latencies[key])
+        if not latencies or len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(percentile * len(latencies)))]
+
+    def generate(self, model_config: ModelConfig, call: Callable[[str], T], get_cost: Callable[[T], float]) -> T:
+        hedge = model_config.hedge
+        if hedge is None:
+            return call(model_config.model)
+
+        key = str(model_config)
+        with self._condition:
+            self._stats[key].requests += 1
+
+        def timed_call(model: str, started: threading.Event | None = None):
+            start = time.monotonic()
+            if started:
+                started.set()
+            return call(model), time.monotonic() - start
+
+        executor = self.get_executor()
+        primary_started = threading.Event()
+        primary = executor.submit(timed_call, model_config.model, primary_started)
+        threshold = self.get_threshold(key, hedge.percentile, hedge.min_samples)
+        if threshold is not None:
+            primary_started.wait()
+        try:
+            primary.result(timeout=threshold)
+        except TimeoutError:
+            pass
+        if primary.done():
+            res, latency = primary.result()
+            self.record_latency(key, latency)
+            return res
+
+        secondary = executor.submit(timed_call, hedge.model or model_config.model)
+        with self._condition:
+            self._stats[key].hedged += 1
+
+        error: BaseException | None = None
+        for future in as_completed([primary, secondary]):
+            error = future.exception()
+            if error is not None:
+                continue
+            loser = secondary if future is primary else primary
+            self.settle_loser(key, loser, get_cost)
+            res, latency = future.result()
+            self.record_latency(key, latency)
+            if future is secondary:
+                with self._condition:
+                    self._stats[key].wins += 1
+            return res
+        assert error is not None
+        raise error
+
+    def record_latency(self, key: str, latency: float):
+        with self._condition:
+            self._latencies[key].append(latency)
+
+    def settle_loser(self, key: str, loser: Future[tuple[T, float]], get_cost: Callable[[T], float]):
+        if loser.cancel():
+            return
+
+        with self._condition:
+            self._stats[key].pending += 1
+
+        def on_done(future: Future[tuple[T, float]]):
+            dollars = get_cost(future.result()[0]) if future.exception() is None else 0.0
+            with self._condition:
+                self._stats[key].pending -= 1
+                self._stats[key].extra_dollars += dollars
+                self._condition.notify_all()
+
+        loser.add_done_callback(on_done)
@@ -0,0 +1,229 @@
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_WINDOW_SECONDS = 60.0
+METRICS_PREFIX = "tokenization_bench"
+
+
+@dataclass
+class ModelProgress:
+    planned: int
+    completed: int
+    failed: int
+    in_flight: int
+    queued: int
+    dollars: float
+    items_per_second: float
+    eta_seconds: float | None
+
+
+@dataclass
+class MetricsSnapshot:
+    models: dict[str, ModelProgress]
+    requests: dict[str, int]
+    rate_limits: dict[str, int]
+    rate_limit_seconds: dict[str, float]
+    concurrency_limits: dict[str, int]
+    requests_per_second: float
+    rate_limits_per_minute: float
+    dollars_per_minute: float
+    dollars: float
+    eta_seconds: float | None
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.planned: dict[str, int] = defaultdict(int)
+        self.completed: dict[str, int] = defaultdict(int)
+        self.failed: dict[str, int] = defaultdict(int)
+        self.in_flight: dict[str, int] = defaultdict(int)
+        self.dollars: dict[str, float] = defaultdict(float)
+        self.requests: dict[str, int] = defaultdict(int)
+        self.rate_limits: dict[str, int] = defaultdict(int)
+        self.rate_limit_seconds: dict[str, float] = defaultdict(float)
+        self.concurrency_limits: dict[str, int] = {}
+        self._completions: deque[tuple[float, str, float]] = deque()
+        self._requests: deque[float] = deque()
+        self._rate_limits: deque[float] = deque()
+
+    def plan(self, model: str, items: int):
+        with self._lock:
+            self.planned[model] += items
+
+    def item_started(self, model: str):
+        with self._lock:
+            self.in_flight[model] += 1
+
+    def item_finished(self, model: str, dollars: float, failed: bool):
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight[model] -= 1
+            self.completed[model] += 1
+            self.failed[model] += failed
+            self.dollars[model] += dollars
+            self._completions.append((now, model, dollars))
+
+    def record_request(self, route: str):
+        with self._lock:
+            self.requests[route] += 1
+            self._requests.append(time.monotonic())
+
+    def record_rate_limit(self, route: str, wait_time: float):
+        with self._lock:
+            self.rate_limits[route] += 1
+            self.rate_limit_seconds[route] += wait_time
+            self._rate_limits.append(time.monotonic())
+
+    def set_concurrency_limit(self, route: str, limit: int):
+        with self._lock:
+            self.concurrency_limits[route] = limit
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._completions and now - self._completions[0][0] > METRICS_WINDOW_SECONDS:
+                self._completions.popleft()
+            for window in (self._requests, self._rate_limits):
+                while window and now - window[0] > METRICS_WINDOW_SECONDS:
+                    window.popleft()
+            elapsed = max(min(now - self.started_at, METRICS_WINDOW_SECONDS), 1.0)
+
+            models: dict[str, ModelProgress] = {}
+            for model in self.planned:
+                rate = sum(1 for _, m, _ in self._completions if m == model) / elapsed
+                remaining = self.planned[model] - self.completed[model]
+                models[model] = ModelProgress(
+                    planned=self.planned[model],
+                    completed=self.completed[model],
+                    failed=self.failed[model],
+                    in_flight=self.in_flight[model],
+                    queued=max(0, remaining - self.in_flight[model]),
+                    dollars=self.dollars[model],
+                    items_per_second=rate,
+                    eta_seconds=remaining / rate if rate > 0 else None,
+                )
+
+            total_rate = len(self._completions) / elapsed
+            total_remaining = sum(self.planned.values()) - sum(self.completed.values())
+            return MetricsSnapshot(
+                models=models,
+                requests=dict(self.requests),
+                rate_limits=dict(self.rate_limits),
+                rate_limit_seconds=dict(self.rate_limit_seconds),
+                concurrency_limits=dict(self.concurrency_limits),
+                requests_per_second=len(self._requests) / elapsed,
+                rate_limits_per_minute=len(self._rate_limits) / elapsed * 60,
+                dollars_per_minute=sum(d for _, _, d in self._completions) / elapsed * 60,
+                dollars=sum(self.dollars.values()),
+                eta_seconds=total_remaining / total_rate if total_rate > 0 else None,
+            )
+
+    def render_prometheus(self):
+        snapshot = self.snapshot()
+        lines: list[str] = []
+
+        def add(name: str, kind: str, help_text: str, samples: list[tuple[dict[str, str], float | None]]):
+            lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                label_str = ",".join(f'{k}="{escape_label(v)}"' for k, v in labels.items())
+                lines.append(f"{METRICS_PREFIX}_{name}{'{' + label_str + '}' if label_str else ''} {'NaN' if value is None else value}")
+
+        for name, key, kind, help_text in [
+            ("items_planned", "planned", "gauge", "Items planned for the run."),
+            ("items_completed_total", "completed", "counter", "Items finished, including failures."),
+            ("items_failed_total", "failed", "counter", "Items recorded as failed."),
+            ("items_in_flight", "in_flight", "gauge", "Items currently waiting on the provider."),
+            ("items_queued", "queued", "gauge", "Items not yet started."),
+            ("dollars_total", "dollars", "counter", "Cumulative spend in dollars."),
+            ("items_per_second", "items_per_second", "gauge", f"Completed items per second over the last {METRICS_WINDOW_SECONDS:.0f}s."),
+            ("eta_seconds", "eta_seconds", "gauge", "Estimated seconds until all planned items finish."),
+        ]:
+            samples = [({"model": model}, getattr(progress, key)) for model, progress in snapshot.models.items()]
+            if key == "eta_seconds":
+                samples.append(({"model": "all"}, snapshot.eta_seconds))
+            add(name, kind, help_text, samples)
+
+        add("requests_total", "counter", "Provider requests sent, including retries.", [({"route": r}, v) for r, v in snapshot.requests.items()])
+        add("rate_limits_total", "counter", "429 responses received.", [({"route": r}, v) for r, v in snapshot.rate_limits.items()])
+        add(
+            "rate_limit_seconds_total",
+            "counter",
+            "Seconds spent waiting for rate-limit resets.",
+            [({"route": r}, v) for r, v in snapshot.rate_limit_seconds.items()],
+        )
+        add(
+            "concurrency_limit",
+            "gauge",
+            "Current adaptive in-flight request limit.",
+            [({"route": r}, v) for r, v in snapshot.concurrency_limits.items()],
+        )
+        add("requests_per_second", "gauge", "Provider requests per second.", [({}, snapshot.requests_per_second)])
+        add("rate_limits_per_minute", "gauge", "429 responses per minute.", [({}, snapshot.rate_limits_per_minute)])
+        add("dollars_per_minute", "gauge", "Spend per minute in dollars.", [({}, snapshot.dollars_per_minute)])
+        return "\n".join(lines) + "\n"
+
+    def render_progress(self):
+        snapshot = self.snapshot()
+        lines = [
+            f"[progress] {snapshot.requests_per_second:.2f} req/s, {snapshot.rate_limits_per_minute:.1f} 429s/min, "
+            f"${snapshot.dollars_per_minute:.4f}/min, ${snapshot.dollars:.4f} total, ETA {format_eta(snapshot.eta_seconds)}"
+        ]
+        if snapshot.concurrency_limits:
+            lines.append("  limits: " + ", ".join(f"{r}={v}" for r, v in snapshot.concurrency_limits.items()))
+        for model, progress in snapshot.models.items():
+            lines.append(
+                f"  {model}: {progress.completed}/{progress.planned} done ({progress.failed} failed), "
+                f"{progress.in_flight} in flight, {progress.queued} queued, ETA {format_eta(progress.eta_seconds)}"
+            )
+        return "\n".join(lines)
+
+    def serve(self, port: int):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: object):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving metrics at http://127.0.0.1:{port}/metrics")
+        return server
+
+    def show_progress(self, interval: float):
+        stop = threading.Event()
+
+        def loop():
+            while not stop.wait(interval):
+                print(self.render_progress())
+
+        threading.Thread(target=loop, daemon=True).start()
+        return stop
+
+
+def escape_label(value: str):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_eta(seconds: float | None):
+    if seconds is None:
+        return "-"
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:d}:{minutes:02d}:{secs:02d}"
+
+
+metrics = Metrics()
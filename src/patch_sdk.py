@@ -1,18 +1,96 @@
+import json
+import random
 import re
 import time
-from typing import Any
+from typing import Any, Literal
 
 from ai_sdk.providers.openai import OpenAIModel
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+from openai.resources.chat.completions import Completions
+
+from src.client_pool import client_pool
+from src.concurrency import concurrency
+from src.metrics import metrics
+from src.router import router
+from src.tracing import tracer
+
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+RATE_LIMIT_FALLBACK_WAIT = 10.0
+
+ErrorClass = Literal["rate_limit", "auth", "transient", "fatal"]
 
 _is_patched = False
 
 
+class MalformedResponseError(Exception):
+    pass
+
+
+def classify_error(e: Exception) -> ErrorClass:
+    if isinstance(e, APIStatusError):
+        if e.status_code == 429:
+            return "rate_limit"
+        if e.status_code in (401, 403):
+            return "auth"
+        return "transient" if e.status_code >= 500 or e.status_code == 408 else "fatal"
+    if "429" in str(e):
+        return "rate_limit"
+    if isinstance(e, (APIConnectionError, TimeoutError, ConnectionError, json.JSONDecodeError, MalformedResponseError)):
+        return "transient"
+    return "fatal"
+
+
+def is_overload(e: Exception, error_class: ErrorClass):
+    if error_class == "rate_limit" or isinstance(e, (APITimeoutError, TimeoutError)):
+        return True
+    return isinstance(e, APIStatusError) and e.status_code >= 500
+
+
+def get_rate_limit_wait(error_str: str):
+    match = re.search(r"'X-RateLimit-Reset':\s*'(\d+)'", error_str)
+    wait_time = int(match.group(1)) / 1000.0 - time.time() + 1.0 if match else 0.0
+    return wait_time if wait_time > 0 else RATE_LIMIT_FALLBACK_WAIT
+
+
+def sleep_until_reset(model: str, wait_time: float):
+    if wait_time > 0:
+        print(f"Rate limit exceeded. Waiting {wait_time:.2f} seconds until reset...")
+        with tracer.span("rate_limit_sleep", "provider", model=model, seconds=wait_time):
+            time.sleep(wait_time)
+
+
+def get_response_cost(result: dict[str, Any]):
+    usage = getattr(result.get("raw_response"), "usage", None)
+    try:
+        return float(getattr(usage, "cost", None) or 0.0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def get_backoff(attempt: int):
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+
+
+def validate_completion(response: Any):
+    if not getattr(response, "choices", None):
+        error = getattr(response, "error", None)
+        raise MalformedResponseError(f"Response has no choices: {error}" if error else "Response has no choices.")
+    return response
+
+
 def patch_openai_provider():
     global _is_patched
     if _is_patched:
         return
 
     original_generate_text = OpenAIModel.generate_text
+    original_create = Completions.create
+
+    def patched_create(self: Completions, *args: Any, **kwargs: Any):
+        response = original_create(self, *args, **kwargs)
+        return response if kwargs.get("stream") else validate_completion(response)
 
     def patched_generate_text(
         self: OpenAIModel, *, prompt: str | None = None, system: str | None = None, messages: list[dict[str, Any]] | None = None, **kwargs: Any
@@ -26,23 +104,49 @@ def patch_openai_provider():
             else:
                 kwargs["reasoning_effort"] = reasoning
 
+        attempt = 0
+        limiter = concurrency.get_limiter(self._model)
+        rejected: set[str] = set()
         while True:
+            started = limiter.acquire()
+            endpoint = router.choose(self._model, exclude=rejected)
+            provider = client_pool.get(self._model, base_url=endpoint.config.base_url, api_key=endpoint.config.api_key) if endpoint else self
             try:
-                result = original_generate_text(self, prompt=prompt, system=system, messages=messages, **kwargs)
+                metrics.record_request(self._model)
+                with tracer.span(
+                    "provider_request", "provider", model=self._model, attempt=attempt, endpoint=endpoint.config.name if endpoint else None
+                ):
+                    result = original_generate_text(provider, prompt=prompt, system=system, messages=messages, **kwargs)
+                limiter.release(started, overloaded=False)
+                if endpoint:
+                    router.record(endpoint, self._model, latency=time.monotonic() - started, dollars=get_response_cost(result), failed=False)
                 break
             except Exception as e:
                 error_str = str(e)
-                if "429" in error_str:
-                    match = re.search(r"'X-RateLimit-Reset':\s*'(\d+)'", error_str)
-                    if match:
-                        reset_timestamp_ms = int(match.group(1))
-                        wait_time = (reset_timestamp_ms / 1000.0) - time.time() + 1.0
-                        if wait_time > 0:
-                            print(f"Rate limit exceeded. Waiting {wait_time:.2f} seconds until reset...")
-                            time.sleep(wait_time)
-                            continue
-                    print("Rate limit exceeded. Waiting 10 seconds (fallback)...")
-                    time.sleep(10)
+                error_class = classify_error(e)
+                limiter.release(started, overloaded=is_overload(e, error_class))
+                if error_class == "rate_limit":
+                    wait_time = get_rate_limit_wait(error_str)
+                    if endpoint:
+                        router.record(endpoint, self._model, latency=time.monotonic() - started, dollars=0.0, failed=True, rate_limit_wait=wait_time)
+                        wait_time = router.get_wait(self._model, exclude=rejected)
+                    metrics.record_rate_limit(self._model, wait_time)
+                    sleep_until_reset(self._model, wait_time)
+                    continue
+                if endpoint:
+                    router.record(endpoint, self._model, latency=time.monotonic() - started, dollars=0.0, failed=True)
+                if error_class == "auth" and endpoint:
+                    rejected.add(endpoint.config.name)
+                    if router.has_candidates(self._model, exclude=rejected):
+                        print(f"Endpoint {endpoint.config.name} rejected the request ({type(e).__name__}). Failing over...")
+                        sleep_until_reset(self._model, router.get_wait(self._model, exclude=rejected))
+                        continue
+                if error_class == "transient" and attempt < MAX_RETRIES:
+                    wait_time = get_backoff(attempt)
+                    attempt += 1
+                    print(f"Transient error ({type(e).__name__}). Retrying in {wait_time:.2f} seconds ({attempt}/{MAX_RETRIES})...")
+                    with tracer.span("retry_backoff", "provider", model=self._model, seconds=wait_time, error=type(e).__name__):
+                        time.sleep(wait_time)
                     continue
                 raise e
 
@@ -56,6 +160,7 @@ def patch_openai_provider():
         return result
 
     OpenAIModel.generate_text = patched_generate_text
+    Completions.create = patched_create
     _is_patched = True
 
 
@@ -0,0 +1,118 @@
+import random
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass, field, replace
+
+from src.run.model import EndpointConfig, EndpointStats
+
+LATENCY_WEIGHT = 0.2
+ERROR_WEIGHT = 0.1
+ERROR_PENALTY = 4.0
+MIN_HEADROOM = 0.05
+UNHEALTHY_FAILURES = 3
+UNHEALTHY_COOLDOWN_SECONDS = 30.0
+
+
+@dataclass
+class EndpointState:
+    config: EndpointConfig
+    in_flight: int = 0
+    latency: float | None = None
+    error_rate: float = 0.0
+    headroom: float = 1.0
+    consecutive_failures: int = 0
+    unavailable_until: float = 0.0
+    stats: dict[str, EndpointStats] = field(default_factory=dict)
+
+
+class EndpointRouter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints: list[EndpointState] = []
+
+    @property
+    def enabled(self):
+        return bool(self._endpoints)
+
+    def configure(self, endpoints: list[EndpointConfig]):
+        with self._lock:
+            self._endpoints = [EndpointState(config=e) for e in endpoints]
+
+    def reset_stats(self):
+        with self._lock:
+            for state in self._endpoints:
+                state.stats.clear()
+
+    def get_stats(self, model: str):
+        with self._lock:
+            return {s.config.name: replace(s.stats[model]) for s in self._endpoints if model in s.stats}
+
+    def get_candidates(self, model: str):
+        return [s for s in self._endpoints if s.config.models is None or model in s.config.models]
+
+    def has_candidates(self, model: str, exclude: set[str]):
+        with self._lock:
+            return any(s.config.name not in exclude for s in self.get_candidates(model))
+
+    @staticmethod
+    def get_score(state: EndpointState):
+        latency = state.latency if state.latency is not None else 0.0
+        return (latency + 0.001) * (1 + state.in_flight) * (1 + ERROR_PENALTY * state.error_rate) / max(state.headroom, MIN_HEADROOM)
+
+    def choose(self, model: str, exclude: set[str] | None = None):
+        now = time.monotonic()
+        with self._lock:
+            candidates = [s for s in self.get_candidates(model) if not exclude or s.config.name not in exclude]
+            if not candidates:
+                return None
+            available = [s for s in candidates if s.unavailable_until <= now] or [min(candidates, key=lambda s: s.unavailable_until)]
+            best = min(self.get_score(s) for s in available)
+            state = random.choice([s for s in available if self.get_score(s) == best])
+            state.in_flight += 1
+            return state
+
+    def get_wait(self, model: str, exclude: set[str] | None = None):
+        with self._lock:
+            candidates = [s for s in self.get_candidates(model) if not exclude or s.config.name not in exclude]
+            return max(0.0, min((s.unavailable_until for s in candidates), default=0.0) - time.monotonic())
+
+    def record(self, state: EndpointState, model: str, latency: float, dollars: float, failed: bool, rate_limit_wait: float | None = None):
+        now = time.monotonic()
+        with self._lock:
+            state.in_flight -= 1
+            stats = state.stats.setdefault(model, EndpointStats())
+            stats.requests += 1
+            stats.dollars += dollars
+            state.error_rate += ERROR_WEIGHT * (failed - state.error_rate)
+
+            if rate_limit_wait is not None:
+                stats.rate_limits += 1
+                state.unavailable_until = max(state.unavailable_until, now + rate_limit_wait)
+            elif failed:
+                stats.failures += 1
+                state.consecutive_failures += 1
+                if state.consecutive_failures >= UNHEALTHY_FAILURES and state.unavailable_until <= now:
+                    state.consecutive_failures = UNHEALTHY_FAILURES - 1
+                    stats.removals += 1
+                    state.unavailable_until = now + UNHEALTHY_COOLDOWN_SECONDS
+                    print(f"Endpoint {state.config.name} is unhealthy. Removing it from rotation for {UNHEALTHY_COOLDOWN_SECONDS:.0f} seconds...")
+            else:
+                state.consecutive_failures = 0
+                state.latency = latency if state.latency is None else state.latency + LATENCY_WEIGHT * (latency - state.latency)
+                stats.latency = state.latency
+
+    def record_headers(self, base_url: str | None, api_key: str | None, headers: Mapping[str, str]):
+        remaining = headers.get("x-ratelimit-remaining-requests") or headers.get("x-ratelimit-remaining")
+        limit = headers.get("x-ratelimit-limit-requests") or headers.get("x-ratelimit-limit")
+        try:
+            headroom = float(remaining or "") / float(limit or "")
+        except (ValueError, ZeroDivisionError):
+            return
+        with self._lock:
+            for state in self._endpoints:
+                if state.config.base_url == base_url and state.config.api_key == api_key:
+                    state.headroom = headroom
+
+
+router = EndpointRouter()
@@ -0,0 +1,35 @@
+import warnings
+
+import numpy as np
+
+BOOTSTRAP_RESAMPLES = 2000
+CONFIDENCE_LEVEL = 0.95
+BOOTSTRAP_CHUNK_SIZE = 1 << 20
+
+
+def bootstrap_mean_differences(differences: list[list[float]], resamples: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    distributions = np.full((len(differences), resamples), np.nan)
+    for i, d in enumerate(differences):
+        if not d:
+            continue
+        values = np.asarray(d, dtype=np.float64)
+        step = max(1, BOOTSTRAP_CHUNK_SIZE // len(values))
+        for start in range(0, resamples, step):
+            stop = min(resamples, start + step)
+            distributions[i, start:stop] = values[rng.integers(0, len(values), size=(stop - start, len(values)))].mean(axis=1)
+    return distributions
+
+
+def combine_distributions(distributions: list[np.ndarray]) -> np.ndarray:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmean(distributions, axis=0)
+
+
+def summarize_distributions(distributions: np.ndarray, confidence_level: float):
+    alpha = (1 - confidence_level) / 2
+    lows, highs = np.quantile(distributions, [alpha, 1 - alpha], axis=1)
+    p_values = np.minimum(1.0, 2 * np.minimum((distributions <= 0).mean(axis=1), (distributions >= 0).mean(axis=1)))
+    valid = ~np.isnan(distributions).any(axis=1)
+    return [(float(low), float(high), float(p_value)) if is_valid else None for low, high, p_value, is_valid in zip(lows, highs, p_values, valid)]
@@ -1,66 +1,169 @@
 import datetime
-import json
+import math
 import random
-from concurrent.futures import ThreadPoolExecutor
-from dataclasses import asdict
+import shutil
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
+from typing import Callable
+
+import numpy as np
 
 import src.patch_sdk as _
+from src.cache import LRUCache
+from src.client_pool import client_pool
+from src.concurrency import concurrency
 from src.dataset.index import DatasetLoader
 from src.dataset.model import DATASET_NAMES, DatasetName
-from src.run.model import BatchResult, DatasetResult, LengthMultiplierResult, ModelConfig, ModelResult, ResultSummary, StrategySummary
+from src.dataset.snapshot import get_snapshot_key
+from src.metrics import metrics
+from src.router import router
+from src.run.bootstrap import BOOTSTRAP_RESAMPLES, CONFIDENCE_LEVEL, bootstrap_mean_differences, combine_distributions, summarize_distributions
+from src.run.model import (
+    BatchResult,
+    ClientConfig,
+    ConcurrencyConfig,
+    DatasetResult,
+    EndpointConfig,
+    LengthMultiplierResult,
+    ModelConfig,
+    ModelResult,
+    ResultSummary,
+    StrategySummary,
+)
+from src.run.stream import CellAggregate, TaskResultSink, write_json
 from src.task.index import TaskRunner
-from src.task.model import TaskResult
+from src.task.model import PreparedTask
+from src.task.store import TaskStore
 from src.tokenizer import TOKENIZATION_STRATEGIES, TokenizationStrategy
+from src.tracing import capture_profile, tracer
 
 RESULT_DIR = Path("data/results")
+PROFILE_DIR = Path("data/profiles")
+TRACE_DIR = Path("data/traces")
+STREAM_DIR = RESULT_DIR / "streams"
+STORE_CACHE_SIZE = 16
 
 
 class Runner:
     task_runner = TaskRunner()
 
+    def __init__(self):
+        self.stores: LRUCache[str, TaskStore] = LRUCache(STORE_CACHE_SIZE)
+
+    def load_store(self, dataset_name: DatasetName, length_multiplier: int, seed: int):
+        key = get_snapshot_key(dataset_name, length_multiplier, seed)
+        store = self.stores.get(key)
+        if store is None:
+            dataset_loader = DatasetLoader(length_multiplier=length_multiplier, seed=seed)
+            store = TaskStore(dataset_loader.load_tasks(dataset_name))
+            self.stores.put(key, store)
+        return store
+
+    def load_cell(self, dataset_name: DatasetName, n: int, length_multiplier: int, seed: int):
+        with tracer.span("load_dataset", "run", dataset=dataset_name, length_multiplier=length_multiplier):
+            store = self.load_store(dataset_name=dataset_name, length_multiplier=length_multiplier, seed=seed)
+        with tracer.span("shuffle", "run", tasks=len(store)):
+            order = list(range(len(store)))
+            random.Random(seed).shuffle(order)
+        return store, order[:n]
+
+    def prepare_cell(self, dataset_name: DatasetName, strategies: list[TokenizationStrategy], n: int, length_multiplier: int, seed: int):
+        with tracer.span("prepare_cell", "run", dataset=dataset_name, length_multiplier=length_multiplier):
+            store, indices = self.load_cell(dataset_name=dataset_name, n=n, length_multiplier=length_multiplier, seed=seed)
+            return [self.task_runner.prepare(strategies=strategies, store=store, index=i, length_multiplier=length_multiplier) for i in indices]
+
     def run(
-        self, model_config: ModelConfig, dataset_name: DatasetName, strategies: list[TokenizationStrategy], n: int, length_multiplier: int, seed: int
+        self,
+        model_config: ModelConfig,
+        dataset_name: DatasetName,
+        strategies: list[TokenizationStrategy],
+        n: int,
+        length_multiplier: int,
+        seed: int,
+        serial: bool = False,
+        samples_per_prompt: int = 1,
+        prepared: list[PreparedTask] | None = None,
+        pack_size: int = 1,
+        stream_path: Path | None = None,
     ):
-        print(f"Running {dataset_name} with {model_config} for n={n}, seed={seed}, length_multiplier={length_multiplier}...")
-        dataset_loader = DatasetLoader(length_multiplier=length_multiplier, seed=seed)
-        all_tasks = list(dataset_loader.load_tasks(dataset_name))
-        random.Random(seed).shuffle(all_tasks)
-        tasks = all_tasks[:n]
-
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            strategy_to_result_list: list[dict[TokenizationStrategy, TaskResult]] = list(
-                executor.map(
-                    lambda t: self.task_runner.run(
-                        model_config=model_config, strategies=strategies, task=t, distractor_candidates=all_tasks, length_multiplier=length_multiplier
-                    ),
-                    tasks,
-                )
+        print(
+            f"Running {dataset_name} with {model_config} for n={n}, seed={seed}, length_multiplier={length_multiplier}, "
+            f"samples_per_prompt={samples_per_prompt}, pack_size={pack_size}..."
+        )
+        prepare_task: Callable[[int], PreparedTask]
+        if prepared is None:
+            store, indices = self.load_cell(dataset_name=dataset_name, n=n, length_multiplier=length_multiplier, seed=seed)
+            tasks = range(len(indices))
+
+            def prepare_task(i: int):
+                return self.task_runner.prepare(strategies=strategies, store=store, index=indices[i], length_multiplier=length_multiplier)
+
+        else:
+            tasks = range(len(prepared))
+            prepare_task = prepared.__getitem__
+        metrics.plan(str(model_config), (len(tasks) - n) * len(strategies))
+
+        stream_path = stream_path or STREAM_DIR / f"{uuid.uuid4().hex}.jsonl"
+        sink = TaskResultSink(stream_path, size=len(tasks))
+        aggregate = CellAggregate(strategies, size=len(tasks))
+
+        def run_pack(pack: range):
+            pack_results = self.task_runner.run(
+                model_config=model_config,
+                strategies=strategies,
+                tasks=[prepare_task(i) for i in pack],
+                serial=serial,
+                samples_per_prompt=samples_per_prompt,
             )
+            for position, s_to_r in zip(pack, pack_results):
+                sink.write(position, s_to_r)
+                aggregate.add(position, s_to_r)
 
-        return LengthMultiplierResult(
-            dollars=sum(r.dollars for s_to_r in strategy_to_result_list for r in s_to_r.values()),
-            summary=self.calculate_summary(strategies, strategy_to_result_list),
-            strategy_results=strategy_to_result_list,
-        )
+        packs = [tasks[i : i + pack_size] for i in range(0, len(tasks), pack_size)]
+        try:
+            if serial:
+                for pack in packs:
+                    run_pack(pack)
+            else:
+                with ThreadPoolExecutor(max_workers=concurrency.get_max_workers(len(strategies))) as executor:
+                    list(executor.map(run_pack, packs))
+        except BaseException:
+            sink.close()
+            stream_path.unlink(missing_ok=True)
+            raise
+        strategy_results = sink.close()
 
-    def calculate_summary(self, strategies: list[TokenizationStrategy], strategy_to_result_list: list[dict[TokenizationStrategy, TaskResult]]):
-        baseline_scores = [s_to_r["baseline"].evaluation for s_to_r in strategy_to_result_list]
-        baseline_avg = sum(baseline_scores) / len(baseline_scores)
+        if aggregate.failures:
+            print(f"{aggregate.failures} of {len(tasks) * len(strategies)} items failed for {dataset_name} with {model_config}")
 
-        summary: ResultSummary = {}
+        concurrency_stats = concurrency.get_stats(model_config.model)
+        print(
+            f"Concurrency limit for {model_config.model}: {concurrency_stats.limit} "
+            f"(peak {concurrency_stats.peak_limit}, {concurrency_stats.decreases} decreases)"
+        )
 
-        for strategy in strategies:
-            strategy_results = [r[strategy] for r in strategy_to_result_list]
-            scores = [r.evaluation for r in strategy_results]
-            dollars_list = [r.dollars for r in strategy_results]
-            avg = sum(scores) / len(scores)
+        for name, endpoint_stats in router.get_stats(model_config.model).items():
+            print(
+                f"Endpoint {name} for {model_config.model}: {endpoint_stats.requests} requests, {endpoint_stats.failures} failures, "
+                f"{endpoint_stats.rate_limits} rate limits, ${endpoint_stats.dollars:.6f}"
+            )
 
-            summary[strategy] = StrategySummary(
-                avg_score=avg, total_dollars=sum(dollars_list), delta=avg - baseline_avg if strategy != "baseline" else None
+        if model_config.hedge:
+            hedge_stats = self.task_runner.hedger.get_stats(str(model_config))
+            print(
+                f"Hedged {hedge_stats.hedged}/{hedge_stats.requests} requests for {model_config}, "
+                f"{hedge_stats.wins} wins, ${hedge_stats.extra_dollars:.6f} extra ({hedge_stats.pending} pending)"
             )
 
-        return summary
+        return LengthMultiplierResult(
+            dollars=aggregate.dollars,
+            summary=aggregate.summary(),
+            strategy_results=strategy_results,
+            cached_dollars=aggregate.cached_dollars,
+            differences=aggregate.differences,
+        )
 
     def run_batch(
         self,
@@ -70,26 +173,123 @@ class Runner:
         n: int,
         length_multipliers: list[int],
         seed: int,
+        metrics_port: int | None = None,
+        progress_interval: float | None = None,
+        trace: bool = False,
+        profile_cell: tuple[str, DatasetName, int] | None = None,
+        samples_per_prompt: int = 1,
+        client_config: ClientConfig | None = None,
+        prefetch: int = 0,
+        pack_size: int = 1,
+        concurrency_config: ConcurrencyConfig | None = None,
+        endpoints: list[EndpointConfig] | None = None,
     ):
-        model_results: dict[str, ModelResult] = {}
-
+        if client_config:
+            client_pool.configure(client_config)
+        if concurrency_config:
+            concurrency.configure(concurrency_config)
+        if endpoints:
+            router.configure(endpoints)
         for model_config in model_configs:
-            dataset_results: dict[DatasetName, DatasetResult] = {}
-            for dataset_name in dataset_names:
-                length_multiplier_results: dict[int, LengthMultiplierResult] = {}
-                for length_multiplier in length_multipliers:
-                    try:
-                        length_multiplier_results[length_multiplier] = self.run(
+            metrics.plan(str(model_config), len(dataset_names) * len(length_multipliers) * n * len(strategies))
+        server = metrics.serve(metrics_port) if metrics_port is not None else None
+        progress = metrics.show_progress(progress_interval) if progress_interval else None
+        started_at = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        stream_dir = STREAM_DIR / started_at
+        if trace:
+            tracer.enable(TRACE_DIR / f"{started_at}.json")
+
+        prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch") if prefetch > 0 else None
+
+        try:
+            self.task_runner.hedger.reset()
+            router.reset_stats()
+            cell_results: dict[str, dict[DatasetName, dict[int, LengthMultiplierResult]]] = {}
+            cells: list[tuple[ModelConfig, DatasetName, int]] = [
+                (mc, d, m) for mc in model_configs for d in dataset_names for m in length_multipliers
+            ]
+            prefetched: dict[int, Future[list[PreparedTask]]] = {}
+
+            for i, (model_config, dataset_name, length_multiplier) in enumerate(cells):
+                profile = profile_cell == (str(model_config), dataset_name, length_multiplier)
+                if prefetcher:
+                    for j in range(i, min(i + prefetch + 1, len(cells))):
+                        if j not in prefetched and profile_cell != (str(cells[j][0]), cells[j][1], cells[j][2]):
+                            prefetched[j] = prefetcher.submit(
+                                self.prepare_cell, dataset_name=cells[j][1], strategies=strategies, n=n, length_multiplier=cells[j][2], seed=seed
+                            )
+                try:
+                    with (
+                        tracer.span("cell", "run", model=str(model_config), dataset=dataset_name, length_multiplier=length_multiplier),
+                        capture_profile(PROFILE_DIR / f"{started_at}_{dataset_name}_m{length_multiplier}") if profile else nullcontext(),
+                    ):
+                        cell_results.setdefault(str(model_config), {}).setdefault(dataset_name, {})[length_multiplier] = self.run(
                             model_config=model_config,
                             dataset_name=dataset_name,
                             strategies=strategies,
                             n=n,
                             length_multiplier=length_multiplier,
                             seed=seed,
+                            serial=profile,
+                            samples_per_prompt=samples_per_prompt,
+                            prepared=prefetched.pop(i).result() if i in prefetched else None,
+                            pack_size=pack_size,
+                            stream_path=stream_dir / f"cell_{i}.jsonl",
                         )
-                    except Exception as e:
-                        print(f"Error running {dataset_name} with {model_config} (m={length_multiplier}): {e}")
+                except Exception as e:
+                    print(f"Error running {dataset_name} with {model_config} (m={length_multiplier}): {e}")
+                    metrics.plan(str(model_config), -n * len(strategies))
+
+            try:
+                batch_result = self.build_batch_result(
+                    model_configs=model_configs,
+                    dataset_names=dataset_names,
+                    strategies=strategies,
+                    n=n,
+                    length_multipliers=length_multipliers,
+                    seed=seed,
+                    cell_results=cell_results,
+                    samples_per_prompt=samples_per_prompt,
+                    pack_size=pack_size,
+                )
+                if batch_result:
+                    self.save_batch_result(batch_result, name=started_at)
+            except BaseException as e:
+                e.add_note(f"Partial task results are kept in {stream_dir}")
+                raise
+            self.remove_streams(stream_dir)
+        finally:
+            if prefetcher:
+                prefetcher.shutdown(cancel_futures=True)
+            if trace:
+                tracer.disable()
+                tracer.export()
+            if progress:
+                progress.set()
+            if server:
+                server.shutdown()
+                server.server_close()
+
+    def build_batch_result(
+        self,
+        model_configs: list[ModelConfig],
+        dataset_names: list[DatasetName],
+        strategies: list[TokenizationStrategy],
+        n: int,
+        length_multipliers: list[int],
+        seed: int,
+        cell_results: dict[str, dict[DatasetName, dict[int, LengthMultiplierResult]]],
+        samples_per_prompt: int = 1,
+        pack_size: int = 1,
+    ):
+        model_results: dict[str, ModelResult] = {}
 
+        for model_config in model_configs:
+            dataset_results: dict[DatasetName, DatasetResult] = {}
+            for dataset_name in dataset_names:
+                length_multiplier_results = {
+                    m: r for m in length_multipliers if (r := cell_results.get(str(model_config), {}).get(dataset_name, {}).get(m))
+                }
                 if length_multiplier_results:
                     dataset_results[dataset_name] = DatasetResult(
                         dollars=sum(r.dollars for r in length_multiplier_results.values()),
@@ -98,14 +298,18 @@ class Runner:
                     )
 
             if dataset_results:
+                hedge_stats = self.task_runner.hedger.settle(str(model_config)) if model_config.hedge else None
                 model_results[str(model_config)] = ModelResult(
-                    dollars=sum(r.dollars for r in dataset_results.values()),
+                    dollars=sum(r.dollars for r in dataset_results.values()) + (hedge_stats.extra_dollars if hedge_stats else 0.0),
                     summary=self.aggregate_summaries(strategies=strategies, summaries=[r.summary for r in dataset_results.values()]),
                     dataset_results=dataset_results,
+                    hedge_stats=hedge_stats,
+                    concurrency_stats=concurrency.get_stats(model_config.model),
+                    endpoint_stats=router.get_stats(model_config.model) if router.enabled else None,
                 )
 
         if not model_results:
-            return
+            return None
 
         batch_result = BatchResult(
             model_config=model_configs,
@@ -117,29 +321,83 @@ class Runner:
             n=n,
             length_multipliers=length_multipliers,
             seed=seed,
+            samples_per_prompt=samples_per_prompt,
+            pack_size=pack_size,
         )
+        self.add_confidence_intervals(strategies=strategies, batch_result=batch_result, seed=seed)
+        return batch_result
 
+    def save_batch_result(self, batch_result: BatchResult, name: str):
         RESULT_DIR.mkdir(parents=True, exist_ok=True)
-        result_path = RESULT_DIR / f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        result_path = RESULT_DIR / f"{name}.json"
         with open(result_path, "w", encoding="utf-8") as f:
-            json.dump(asdict(batch_result), f, indent=4, ensure_ascii=False)
+            write_json(f, batch_result)
         print(f"Results saved to {result_path}")
+        return result_path
+
+    def remove_streams(self, stream_dir: Path):
+        shutil.rmtree(stream_dir, ignore_errors=True)
 
     def aggregate_summaries(self, strategies: list[TokenizationStrategy], summaries: list[ResultSummary]):
-        baseline_scores = [s["baseline"].avg_score for s in summaries]
-        baseline_avg = sum(baseline_scores) / len(baseline_scores)
+        baseline_scores = [v for s in summaries if (v := s["baseline"].avg_score) is not None]
+        baseline_avg = sum(baseline_scores) / len(baseline_scores) if baseline_scores else None
 
         root_summary: ResultSummary = {}
         for strategy in strategies:
-            scores = [s[strategy].avg_score for s in summaries]
+            scores = [v for s in summaries if (v := s[strategy].avg_score) is not None]
             dollars = [s[strategy].total_dollars for s in summaries]
-            avg = sum(scores) / len(scores)
+            avg = sum(scores) / len(scores) if scores else None
+            variances = [v for s in summaries if (v := s[strategy].sample_variance) is not None]
 
             root_summary[strategy] = StrategySummary(
-                avg_score=avg, total_dollars=sum(dollars), delta=avg - baseline_avg if strategy != "baseline" else None
+                avg_score=avg,
+                total_dollars=sum(dollars),
+                delta=avg - baseline_avg if strategy != "baseline" and avg is not None and baseline_avg is not None else None,
+                failures=sum(s[strategy].failures for s in summaries),
+                sample_variance=sum(variances) / len(variances) if variances else None,
             )
         return root_summary
 
+    def add_confidence_intervals(self, strategies: list[TokenizationStrategy], batch_result: BatchResult, seed: int):
+        compared = [s for s in strategies if s != "baseline"]
+        if not compared:
+            return
+
+        cells = [
+            (lm_result, strategy)
+            for model_result in batch_result.model_results.values()
+            for dataset_result in model_result.dataset_results.values()
+            for lm_result in dataset_result.length_multiplier_results.values()
+            for strategy in compared
+        ]
+        cell_distributions = bootstrap_mean_differences(
+            [[d for d in lm_result.differences[strategy] if not math.isnan(d)] for lm_result, strategy in cells],
+            resamples=BOOTSTRAP_RESAMPLES,
+            seed=seed,
+        )
+        cell_to_distribution = {(id(lm_result), strategy): d for (lm_result, strategy), d in zip(cells, cell_distributions)}
+
+        targets: list[tuple[StrategySummary, np.ndarray]] = []
+        for strategy in compared:
+            model_distributions: list[np.ndarray] = []
+            for model_result in batch_result.model_results.values():
+                dataset_distributions: list[np.ndarray] = []
+                for dataset_result in model_result.dataset_results.values():
+                    lm_distributions: list[np.ndarray] = []
+                    for lm_result in dataset_result.length_multiplier_results.values():
+                        lm_distributions.append(cell_to_distribution[(id(lm_result), strategy)])
+                        targets.append((lm_result.summary[strategy], lm_distributions[-1]))
+                    dataset_distributions.append(combine_distributions(lm_distributions))
+                    targets.append((dataset_result.summary[strategy], dataset_distributions[-1]))
+                model_distributions.append(combine_distributions(dataset_distributions))
+                targets.append((model_result.summary[strategy], model_distributions[-1]))
+            targets.append((batch_result.summary[strategy], combine_distributions(model_distributions)))
+
+        intervals = summarize_distributions(np.stack([distribution for _summary, distribution in targets]), confidence_level=CONFIDENCE_LEVEL)
+        for (summary, _distribution), interval in zip(targets, intervals):
+            if interval:
+                summary.ci_low, summary.ci_high, summary.p_value = interval
+
 
 if __name__ == "__main__":
     runner = Runner()
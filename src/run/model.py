@@ -1,18 +1,80 @@
-from dataclasses import dataclass
+from array import array
+from dataclasses import dataclass, field
 from typing import Literal, override
 
 from src.dataset.model import DatasetName
-from src.task.model import TaskResult
 from src.tokenizer import TokenizationStrategy
 
 Reasoning = Literal[None, "none", "low", "medium", "high"]
 REASONINGS: list[Reasoning] = [None, "none", "low", "medium", "high"]
 
 
+@dataclass
+class HedgeConfig:
+    percentile: float = 0.95
+    min_samples: int = 20
+    model: str | None = None
+
+
+@dataclass
+class ClientConfig:
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    timeout: float = 600.0
+    connect_timeout: float = 10.0
+    http2: bool = False
+
+
+@dataclass
+class ConcurrencyConfig:
+    initial_limit: int = 5
+    min_limit: int = 1
+    max_limit: int = 64
+    increase: float = 1.0
+    decrease_factor: float = 0.5
+    latency_tolerance: float = 2.0
+
+
+@dataclass
+class ConcurrencyStats:
+    limit: int
+    peak_limit: int
+    decreases: int = 0
+
+
+@dataclass
+class EndpointConfig:
+    name: str
+    base_url: str | None = None
+    api_key: str | None = None
+    models: list[str] | None = None
+
+
+@dataclass
+class EndpointStats:
+    requests: int = 0
+    failures: int = 0
+    rate_limits: int = 0
+    removals: int = 0
+    dollars: float = 0.0
+    latency: float | None = None
+
+
+@dataclass
+class HedgeStats:
+    requests: int = 0
+    hedged: int = 0
+    wins: int = 0
+    extra_dollars: float = 0.0
+    pending: int = 0
+
+
 @dataclass()
 class ModelConfig:
     model: str
     reasoning: Reasoning = None
+    hedge: HedgeConfig | None = None
 
     @override
     def __str__(self) -> str:
@@ -24,19 +86,32 @@ class ModelConfig:
 
 @dataclass
 class StrategySummary:
-    avg_score: float
+    avg_score: float | None
     total_dollars: float
     delta: float | None = None
+    failures: int = 0
+    ci_low: float | None = None
+    ci_high: float | None = None
+    p_value: float | None = None
+    sample_variance: float | None = None
 
 
 ResultSummary = dict[TokenizationStrategy, StrategySummary]
 
 
+@dataclass
+class StreamedTaskResults:
+    path: str
+    offsets: array[int]
+
+
 @dataclass
 class LengthMultiplierResult:
     dollars: float
     summary: ResultSummary
-    strategy_results: list[dict[TokenizationStrategy, TaskResult]]
+    strategy_results: StreamedTaskResults
+    cached_dollars: float = 0.0
+    differences: dict[TokenizationStrategy, array[float]] = field(default_factory=dict, metadata={"serialize": False})
 
 
 @dataclass
@@ -51,6 +126,9 @@ class ModelResult:
     dollars: float
     summary: ResultSummary
     dataset_results: dict[DatasetName, DatasetResult]
+    hedge_stats: HedgeStats | None = None
+    concurrency_stats: ConcurrencyStats | None = None
+    endpoint_stats: dict[str, EndpointStats] | None = None
 
 
 @dataclass
@@ -64,3 +142,5 @@ class BatchResult:
     seed: int
     summary: ResultSummary
     model_results: dict[str, ModelResult]
+    samples_per_prompt: int = 1
+    pack_size: int = 1
@@ -0,0 +1,135 @@
+import json
+import math
+import statistics
+import threading
+from array import array
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass, fields, is_dataclass
+from pathlib import Path
+from typing import Any, TextIO
+
+from src.run.model import ResultSummary, StrategySummary, StreamedTaskResults
+from src.task.model import TaskResult
+from src.tokenizer import TokenizationStrategy
+
+JSON_INDENT = 4
+
+
+class TaskResultSink:
+    def __init__(self, path: Path, size: int):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.offsets = array("q", [-1]) * size
+        self._lock = threading.Lock()
+        self._file = open(path, "wb")
+
+    def write(self, position: int, strategy_to_result: dict[TokenizationStrategy, TaskResult]):
+        line = (json.dumps({s: asdict(r) for s, r in strategy_to_result.items()}, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self.offsets[position] = self._file.tell()
+            self._file.write(line)
+
+    def close(self):
+        self._file.close()
+        return StreamedTaskResults(path=str(self.path), offsets=self.offsets)
+
+
+@dataclass(slots=True)
+class StrategyAggregate:
+    score_sum: float = 0.0
+    scored: int = 0
+    failures: int = 0
+    dollars: float = 0.0
+    cached_dollars: float = 0.0
+    variance_sum: float = 0.0
+    variance_count: int = 0
+
+
+class CellAggregate:
+    def __init__(self, strategies: list[TokenizationStrategy], size: int):
+        self._lock = threading.Lock()
+        self.strategies = strategies
+        self.aggregates = {s: StrategyAggregate() for s in strategies}
+        self.differences: dict[TokenizationStrategy, array[float]] = {s: array("d", [math.nan]) * size for s in strategies if s != "baseline"}
+
+    def add(self, position: int, strategy_to_result: dict[TokenizationStrategy, TaskResult]):
+        baseline = strategy_to_result["baseline"]
+        with self._lock:
+            for strategy, result in strategy_to_result.items():
+                aggregate = self.aggregates[strategy]
+                aggregate.dollars += result.dollars
+                if result.cached:
+                    aggregate.cached_dollars += result.dollars
+                if result.error is not None:
+                    aggregate.failures += 1
+                    continue
+                aggregate.score_sum += result.evaluation
+                aggregate.scored += 1
+                if result.evaluations and len(result.evaluations) > 1:
+                    aggregate.variance_sum += statistics.variance(result.evaluations)
+                    aggregate.variance_count += 1
+                if strategy != "baseline" and baseline.error is None:
+                    self.differences[strategy][position] = result.evaluation - baseline.evaluation
+
+    @property
+    def dollars(self):
+        return sum(a.dollars for a in self.aggregates.values())
+
+    @property
+    def cached_dollars(self):
+        return sum(a.cached_dollars for a in self.aggregates.values())
+
+    @property
+    def failures(self):
+        return sum(a.failures for a in self.aggregates.values())
+
+    def summary(self):
+        baseline = self.aggregates["baseline"]
+        baseline_avg = baseline.score_sum / baseline.scored if baseline.scored else None
+
+        summary: ResultSummary = {}
+        for strategy in self.strategies:
+            aggregate = self.aggregates[strategy]
+            avg = aggregate.score_sum / aggregate.scored if aggregate.scored else None
+            summary[strategy] = StrategySummary(
+                avg_score=avg,
+                total_dollars=aggregate.dollars,
+                delta=avg - baseline_avg if strategy != "baseline" and avg is not None and baseline_avg is not None else None,
+                failures=aggregate.failures,
+                sample_variance=aggregate.variance_sum / aggregate.variance_count if aggregate.variance_count else None,
+            )
+        return summary
+
+
+def read_task_results(streamed: StreamedTaskResults):
+    with open(streamed.path, "rb") as f:
+        for offset in streamed.offsets:
+            if offset >= 0:
+                f.seek(offset)
+                yield json.loads(f.readline())
+
+
+def write_json(f: TextIO, value: Any, level: int = 0):
+    if isinstance(value, StreamedTaskResults):
+        write_container(f, ((None, r) for r in read_task_results(value)), "[]", level)
+    elif is_dataclass(value) and not isinstance(value, type):
+        write_container(f, ((x.name, getattr(value, x.name)) for x in fields(value) if x.metadata.get("serialize", True)), "{}", level)
+    elif isinstance(value, dict):
+        write_container(f, value.items(), "{}", level)
+    elif isinstance(value, list):
+        write_container(f, ((None, v) for v in value), "[]", level)
+    else:
+        f.write(json.dumps(value, ensure_ascii=False))
+
+
+def write_container(f: TextIO, items: Iterable[tuple[Any, Any]], brackets: str, level: int):
+    separator = "\n" + " " * JSON_INDENT * (level + 1)
+    f.write(brackets[0])
+    empty = True
+    for key, item in items:
+        f.write(separator if empty else "," + separator)
+        empty = False
+        if brackets == "{}":
+            f.write(json.dumps(str(key), ensure_ascii=False) + ": ")
+        write_json(f, item, level + 1)
+    f.write(brackets[1] if empty else "\n" + " " * JSON_INDENT * level + brackets[1])
@@ -1,22 +1,37 @@
+import json
 import random
 import re
 from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
 
-from ai_sdk import generate_text, openai
+from ai_sdk import generate_text
 from ai_sdk.generate_text import GenerateTextResult
 from dotenv import load_dotenv
 
+from src.cache import LRUCache
+from src.client_pool import client_pool
+from src.hedge import Hedger
+from src.metrics import metrics
 from src.run.model import ModelConfig
-from src.task.model import NIL_LABELS, Task, TaskConfig, TaskResult, TaskType
+from src.task.model import NIL_LABELS, PreparedTask, Task, TaskConfig, TaskPrompt, TaskResult, TaskType
+from src.task.store import TaskStore
 from src.tokenizer import TokenizationStrategy, Tokenizer
+from src.tracing import tracer
 
 load_dotenv()
 
 tokenizer = Tokenizer()
 
+PACK_INSTRUCTION = (
+    "There are {count} [Item] blocks below. Apply the instructions above to each item independently. "
+    'Respond with only a JSON object that maps each item number to its answer as a string, for example {{"1": "...", "2": "..."}}.'
+)
+
 
 class TaskRunner:
+    hedger = Hedger()
+    response_cache: LRUCache[tuple[str, str, int], list[GenerateTextResult]] | None = None
+    single_choice_models: set[str] = set()
     configs: dict[TaskType, TaskConfig] = {
         "multiple_choice": TaskConfig(
             get_instruction_prompt=lambda task, strategy: (
@@ -203,62 +218,176 @@ class TaskRunner:
         return dollars
 
     @staticmethod
-    def select_distractors(task: Task, distractor_candidates: list[Task], length_multiplier: int) -> list[Task]:
-        pool = [d for d in distractor_candidates if d.id != task.id and d.type == task.type]
-        if not pool:
-            return []
-        sample_size = min(length_multiplier, len(pool))
-        return random.sample(pool, sample_size)
+    def get_texts_from_response(res: GenerateTextResult):
+        choices = getattr(res.raw_response, "choices", None) or []
+        return [res.text] + [c.message.content or "" for c in choices[1:]]
+
+    def generate(self, model_config: ModelConfig, user_prompt: str, samples: int):
+        def request(n: int):
+            kwargs = {"n": n} if n > 1 else {}
+            return self.hedger.generate(
+                model_config,
+                lambda model: generate_text(model=client_pool.get(model), reasoning=model_config.reasoning, prompt=user_prompt, **kwargs),
+                self.get_cost_from_response,
+            )
+
+        results: list[GenerateTextResult] = []
+        if samples == 1 or str(model_config) not in self.single_choice_models:
+            results.append(request(samples))
+            if len(self.get_texts_from_response(results[0])) < samples:
+                self.single_choice_models.add(str(model_config))
+        missing = samples - sum(len(self.get_texts_from_response(r)) for r in results)
+        if missing > 0:
+            with ThreadPoolExecutor(max_workers=missing) as executor:
+                results.extend(executor.map(lambda _: request(1), range(missing)))
+        return results
+
+    @staticmethod
+    def select_distractors(store: TaskStore, index: int, length_multiplier: int) -> list[int]:
+        task_id = store.ids[index]
+        pool = store.type_indices[store.get_type(index)]
+        picks = random.sample(pool, min(length_multiplier + 1, len(pool)))
+        return [i for i in picks if store.ids[i] != task_id][:length_multiplier]
 
-    def run_strategy(self, model_config: ModelConfig, strategy: TokenizationStrategy, task: Task, distractors: list[Task], length_multiplier: int):
+    def build_prompt(self, strategy: TokenizationStrategy, task: Task, distractors: list[Task], length_multiplier: int):
         config = self.configs[task.type]
-        task_prompt = config.get_task_prompt(task, strategy, distractors, length_multiplier)
-        effective_ground_truths = config.get_ground_truths(task, distractors, length_multiplier)
-        evaluation_task = Task(
-            id=task.id,
-            type=task.type,
-            context=task.context,
-            question=task.question,
-            options=task.options,
-            ground_truths=effective_ground_truths,
-        )
-        user_prompt = "\n\n".join([config.get_instruction_prompt(task, strategy), task_prompt])
+        with tracer.span("build_prompt", "task", task_id=task.id, strategy=strategy):
+            task_prompt = config.get_task_prompt(task, strategy, distractors, length_multiplier)
+            return TaskPrompt(
+                task_prompt=task_prompt,
+                user_prompt="\n\n".join([config.get_instruction_prompt(task, strategy), task_prompt]),
+                ground_truths=config.get_ground_truths(task, distractors, length_multiplier),
+            )
 
-        res = generate_text(model=openai(model_config.model), reasoning=model_config.reasoning, prompt=user_prompt)
+    def prepare(self, strategies: list[TokenizationStrategy], store: TaskStore, index: int, length_multiplier: int):
+        task = store.get(index)
+        with tracer.span("select_distractors", "task", task_id=task.id, candidates=len(store.type_indices[task.type])):
+            distractors = [store.get(i) for i in self.select_distractors(store=store, index=index, length_multiplier=length_multiplier)]
+        return PreparedTask(task=task, prompts={s: self.build_prompt(s, task, distractors, length_multiplier) for s in strategies})
 
-        return TaskResult(
-            task_id=task.id,
-            task_type=task.type,
-            tokenization_strategy=strategy,
-            task_prompt=task_prompt,
-            response=res.text,
-            dollars=self.get_cost_from_response(res),
-            evaluation=config.evaluate(evaluation_task, strategy, res.text),
-            ground_truths=effective_ground_truths,
-            reasoning=res.reasoning,
+    @staticmethod
+    def build_packed_prompt(config: TaskConfig, strategy: TokenizationStrategy, tasks: list[PreparedTask]):
+        return "\n\n".join(
+            [
+                config.get_instruction_prompt(tasks[0].task, strategy),
+                PACK_INSTRUCTION.format(count=len(tasks)),
+                *(f"[Item {i}]\n{t.prompts[strategy].task_prompt}" for i, t in enumerate(tasks, 1)),
+            ]
         )
 
+    @staticmethod
+    def parse_packed_response(response: str, count: int):
+        start, end = response.find("{"), response.rfind("}")
+        try:
+            answers = json.loads(response[start : end + 1]) if 0 <= start < end else {}
+        except json.JSONDecodeError:
+            answers = {}
+        if not isinstance(answers, dict):
+            answers = {}
+        return ["\n".join(map(str, a)) if isinstance(a := answers.get(str(i), ""), list) else str(a) for i in range(1, count + 1)]
+
+    def run_strategy(self, model_config: ModelConfig, strategy: TokenizationStrategy, tasks: list[PreparedTask], samples_per_prompt: int = 1):
+        config = self.configs[tasks[0].task.type]
+        prompts = [t.prompts[strategy] for t in tasks]
+        task_ids = ", ".join(t.task.id for t in tasks)
+        user_prompt = prompts[0].user_prompt if len(tasks) == 1 else self.build_packed_prompt(config, strategy, tasks)
+
+        cache_key = (str(model_config), user_prompt, samples_per_prompt)
+        results = self.response_cache.get(cache_key) if self.response_cache is not None else None
+        cached = results is not None
+
+        for _ in tasks:
+            metrics.item_started(str(model_config))
+        try:
+            if results is None:
+                with tracer.span("request", "task", task_id=task_ids, strategy=strategy, model=str(model_config), samples=samples_per_prompt):
+                    results = self.generate(model_config, user_prompt, samples_per_prompt)
+                if self.response_cache is not None:
+                    self.response_cache.put(cache_key, results)
+        except Exception as e:
+            print(f"Request failed for {task_ids} ({strategy}) with {model_config}: {e}")
+            task_results: list[TaskResult] = []
+            for t, prompt in zip(tasks, prompts):
+                metrics.item_finished(str(model_config), dollars=0.0, failed=True)
+                task_results.append(
+                    TaskResult(
+                        task_id=t.task.id,
+                        task_type=t.task.type,
+                        tokenization_strategy=strategy,
+                        task_prompt=prompt.task_prompt,
+                        response="",
+                        dollars=0.0,
+                        evaluation=0.0,
+                        ground_truths=prompt.ground_truths,
+                        reasoning=None,
+                        error=f"{type(e).__name__}: {e}",
+                    )
+                )
+            return task_results
+
+        texts = [text for res in results for text in self.get_texts_from_response(res)][:samples_per_prompt]
+        answers = [[text] if len(tasks) == 1 else self.parse_packed_response(text, len(tasks)) for text in texts]
+        dollars = sum(self.get_cost_from_response(res) for res in results)
+        weights = [len(prompt.task_prompt) for prompt in prompts]
+
+        task_results = []
+        for i, (t, prompt) in enumerate(zip(tasks, prompts)):
+            evaluation_task = Task(
+                id=t.task.id,
+                type=t.task.type,
+                context=t.task.context,
+                question=t.task.question,
+                options=t.task.options,
+                ground_truths=prompt.ground_truths,
+            )
+            responses = [a[i] for a in answers]
+            evaluations: list[float] = []
+            error: str | None = None
+            try:
+                with tracer.span("evaluate", "task", task_id=t.task.id, strategy=strategy):
+                    evaluations = [config.evaluate(evaluation_task, strategy, response) for response in responses]
+            except Exception as e:
+                print(f"Evaluation failed for {t.task.id} ({strategy}): {e}")
+                error = f"{type(e).__name__}: {e}"
+
+            item_dollars = dollars * weights[i] / sum(weights)
+            metrics.item_finished(str(model_config), dollars=0.0 if cached else item_dollars, failed=error is not None)
+            task_results.append(
+                TaskResult(
+                    task_id=t.task.id,
+                    task_type=t.task.type,
+                    tokenization_strategy=strategy,
+                    task_prompt=prompt.task_prompt,
+                    response=responses[0],
+                    dollars=item_dollars,
+                    evaluation=sum(evaluations) / len(evaluations) if evaluations else 0.0,
+                    ground_truths=prompt.ground_truths,
+                    reasoning=results[0].reasoning,
+                    error=error,
+                    cached=cached,
+                    responses=responses if samples_per_prompt > 1 else None,
+                    evaluations=evaluations if samples_per_prompt > 1 and error is None else None,
+                )
+            )
+        return task_results
+
     def run(
         self,
         model_config: ModelConfig,
         strategies: list[TokenizationStrategy],
-        task: Task,
-        distractor_candidates: list[Task],
-        length_multiplier: int,
+        tasks: list[PreparedTask],
+        serial: bool = False,
+        samples_per_prompt: int = 1,
     ):
-        distractors = self.select_distractors(task=task, distractor_candidates=distractor_candidates, length_multiplier=length_multiplier)
-        with ThreadPoolExecutor() as executor:
-            task_results = list(
-                executor.map(
-                    lambda strategy: self.run_strategy(
-                        model_config=model_config,
-                        strategy=strategy,
-                        task=task,
-                        distractors=distractors,
-                        length_multiplier=length_multiplier,
-                    ),
-                    strategies,
-                )
-            )
-        strategy_to_result: dict[TokenizationStrategy, TaskResult] = {r.tokenization_strategy: r for r in task_results}
-        return strategy_to_result
+        def run_strategy(strategy: TokenizationStrategy):
+            return self.run_strategy(model_config=model_config, strategy=strategy, tasks=tasks, samples_per_prompt=samples_per_prompt)
+
+        if serial:
+            strategy_results = [run_strategy(strategy) for strategy in strategies]
+        else:
+            with ThreadPoolExecutor() as executor:
+                strategy_results = list(executor.map(run_strategy, strategies))
+        strategy_to_result_list: list[dict[TokenizationStrategy, TaskResult]] = [
+            {r.tokenization_strategy: r for r in task_results} for task_results in zip(*strategy_results)
+        ]
+        return strategy_to_result_list
@@ -9,7 +9,7 @@ TASK_TYPES: list[TaskType] = ["multiple_choice", "nli", "extraction", "correctio
 NIL_LABELS = ["Entailment", "Contradiction", "Neutral"]
 
 
-@dataclass
+@dataclass(slots=True)
 class Task:
     id: str
     type: TaskType
@@ -38,3 +38,20 @@ class TaskResult:
     dollars: float
     evaluation: float
     reasoning: str | None
+    error: str | None = None
+    cached: bool = False
+    responses: list[str] | None = None
+    evaluations: list[float] | None = None
+
+
+@dataclass(slots=True)
+class TaskPrompt:
+    task_prompt: str
+    user_prompt: str
+    ground_truths: list[str] | list[int]
+
+
+@dataclass(slots=True)
+class PreparedTask:
+    task: Task
+    prompts: dict[TokenizationStrategy, TaskPrompt]
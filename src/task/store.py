@@ -0,0 +1,66 @@
+from array import array
+from collections.abc import Iterable
+
+from src.task.model import TASK_TYPES, Task, TaskType
+
+NO_STRING = -1
+
+
+class TaskStore:
+    __slots__ = (
+        "strings",
+        "ids",
+        "types",
+        "contexts",
+        "questions",
+        "option_offsets",
+        "options",
+        "ground_truths",
+        "type_indices",
+    )
+
+    def __init__(self, tasks: Iterable[Task]):
+        string_ids: dict[str, int] = {}
+        self.strings: list[str] = []
+        self.ids: list[str] = []
+        self.types = array("B")
+        self.contexts = array("i")
+        self.questions = array("i")
+        self.option_offsets = array("I", [0])
+        self.options = array("I")
+        self.ground_truths: list[list[str] | list[int]] = []
+        self.type_indices: dict[TaskType, list[int]] = {}
+
+        def intern(string: str):
+            string_id = string_ids.get(string)
+            if string_id is None:
+                string_id = string_ids[string] = len(self.strings)
+                self.strings.append(string)
+            return string_id
+
+        for task in tasks:
+            self.ids.append(task.id)
+            self.types.append(TASK_TYPES.index(task.type))
+            self.contexts.append(intern(task.context) if task.context is not None else NO_STRING)
+            self.questions.append(intern(task.question))
+            self.options.extend(intern(option) for option in task.options)
+            self.option_offsets.append(len(self.options))
+            self.ground_truths.append(task.ground_truths)
+            self.type_indices.setdefault(task.type, []).append(len(self.ids) - 1)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_type(self, index: int):
+        return TASK_TYPES[self.types[index]]
+
+    def get(self, index: int):
+        context = self.contexts[index]
+        return Task(
+            id=self.ids[index],
+            type=self.get_type(index),
+            context=self.strings[context] if context != NO_STRING else None,
+            question=self.strings[self.questions[index]],
+            options=[self.strings[o] for o in self.options[self.option_offsets[index] : self.option_offsets[index + 1]]],
+            ground_truths=self.ground_truths[index],
+        )
@@ -1,37 +1,48 @@
-import threading
+import queue
+from functools import lru_cache
 from typing import Literal
 
 from fugashi import Tagger
 
+from src.tracing import tracer
+
 TokenizationStrategy = Literal["baseline", "character", "morphology"]
 
 
 TOKENIZATION_STRATEGIES: list[TokenizationStrategy] = ["baseline", "character", "morphology"]
 
+MORPHOLOGY_CACHE_SIZE = 8192
+
 
 class Tokenizer:
     def __init__(self):
-        self._local = threading.local()
-
-    @property
-    def tagger(self) -> Tagger:
-        if not hasattr(self._local, "tagger"):
-            self._local.tagger = Tagger("-Owakati")
-        return self._local.tagger
+        self._taggers: queue.SimpleQueue[Tagger] = queue.SimpleQueue()
+        self._morphology_cache = lru_cache(maxsize=MORPHOLOGY_CACHE_SIZE)(self._parse_morphology)
 
     def tokenize(self, string: str, strategy: TokenizationStrategy):
-        if strategy == "baseline":
-            return string
-        elif strategy == "character":
-            return self.de_tokenize_character(string)
-        elif strategy == "morphology":
-            return self.de_tokenize_morphology(string)
+        with tracer.span("tokenize", "tokenizer", strategy=strategy, chars=len(string)):
+            if strategy == "baseline":
+                return string
+            elif strategy == "character":
+                return self.de_tokenize_character(string)
+            elif strategy == "morphology":
+                return self.de_tokenize_morphology(string)
 
     def de_tokenize_character(self, string: str):
         return " ".join(list(string))
 
     def de_tokenize_morphology(self, string: str):
-        return self.tagger.parse(string).strip()
+        return self._morphology_cache(string)
+
+    def _parse_morphology(self, string: str):
+        try:
+            tagger = self._taggers.get_nowait()
+        except queue.Empty:
+            tagger = Tagger("-Owakati")
+        try:
+            return tagger.parse(string).strip()
+        finally:
+            self._taggers.put(tagger)
 
     def normalize(self, s: str, strategy: TokenizationStrategy):
         s = s.replace("**", "").replace("__", "")
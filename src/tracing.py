@@ -0,0 +1,116 @@
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, TextIO
+
+TRACE_FLUSH_EVENTS = 10000
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._events: list[dict[str, Any]] = []
+        self._thread_names: dict[int, str] = {}
+        self._origin = time.perf_counter()
+        self._path: Path | None = None
+        self._file: TextIO | None = None
+        self._written = 0
+
+    def enable(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._events.clear()
+            self._thread_names.clear()
+            self._origin = time.perf_counter()
+            self._path = path
+            self._file = open(path, "w", encoding="utf-8")
+            self._file.write('{"displayTimeUnit": "ms", "traceEvents": [')
+            self._written = 0
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name: str, category: str, **args: Any) -> AbstractContextManager[None]:
+        if not self.enabled:
+            return nullcontext()
+        return self._record(name, category, args)
+
+    @contextmanager
+    def _record(self, name: str, category: str, args: dict[str, Any]):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            thread_id = threading.get_native_id()
+            with self._lock:
+                if self._file is not None:
+                    self._thread_names.setdefault(thread_id, threading.current_thread().name)
+                    self._events.append(
+                        {
+                            "name": name,
+                            "cat": category,
+                            "ph": "X",
+                            "ts": (start - self._origin) * 1e6,
+                            "dur": (end - start) * 1e6,
+                            "pid": os.getpid(),
+                            "tid": thread_id,
+                            "args": args,
+                        }
+                    )
+                    if len(self._events) >= TRACE_FLUSH_EVENTS:
+                        self._flush(self._file)
+
+    def _flush(self, f: TextIO):
+        for event in self._events:
+            f.write(("," if self._written else "") + "\n" + json.dumps(event, ensure_ascii=False, default=str))
+            self._written += 1
+        self._events.clear()
+
+    def export(self):
+        with self._lock:
+            if self._file is None or self._path is None:
+                return
+            spans = self._written + len(self._events)
+            self._events.extend(
+                {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread_id, "args": {"name": thread_name}}
+                for thread_id, thread_name in self._thread_names.items()
+            )
+            self._flush(self._file)
+            self._file.write("\n]}\n")
+            self._file.close()
+            self._file = None
+            path = self._path
+        print(f"Trace with {spans} spans saved to {path}")
+
+
+@contextmanager
+def capture_profile(path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    profiler = cProfile.Profile()
+    tracemalloc.start(25)
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        profiler.dump_stats(path.with_suffix(".prof"))
+        with open(path.with_suffix(".tracemalloc.txt"), "w", encoding="utf-8") as f:
+            f.write(f"Peak traced memory: {peak / 1024 / 1024:.2f} MiB\n\n")
+            for stat in snapshot.statistics("lineno")[:50]:
+                f.write(f"{stat}\n")
+        print(f"Profile saved to {path.with_suffix('.prof')} and {path.with_suffix('.tracemalloc.txt')}")
+
+
+tracer = Tracer()
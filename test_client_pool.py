@@ -0,0 +1,86 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ai_sdk import generate_text
+
+import src.patch_sdk as _
+from src.client_pool import client_pool
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests: list[dict[str, object]] = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        StubHandler.requests.append(
+            {"path": self.path, "authorization": self.headers.get("Authorization"), "body": body, "client_address": self.client_address}
+        )
+        data = json.dumps(
+            {
+                "id": "stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "4"}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: object):
+        pass
+
+
+def test_generate_text_through_pool():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        base_url = f"http://127.0.0.1:{server.server_port}/v1"
+        result = generate_text(model=client_pool.get("stub-model", base_url=base_url, api_key="stub-key"), prompt="What is 2 plus 2?")
+        assert result.text == "4"
+        assert len(StubHandler.requests) == 1
+        request = StubHandler.requests[0]
+        assert request["path"] == "/v1/chat/completions"
+        assert request["authorization"] == "Bearer stub-key"
+        assert request["body"] == {"model": "stub-model", "messages": [{"role": "user", "content": "What is 2 plus 2?"}]}
+    finally:
+        server.shutdown()
+        server.server_close()
+        client_pool.close()
+        StubHandler.requests.clear()
+
+
+def test_pool_reuses_connections():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        base_url = f"http://127.0.0.1:{server.server_port}/v1"
+
+        def send(i: int):
+            return generate_text(model=client_pool.get("stub-model", base_url=base_url, api_key="stub-key"), prompt=f"Request {i}").text
+
+        assert [send(i) for i in range(4)] == ["4"] * 4
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for _ in range(3):
+                assert list(executor.map(send, range(4))) == ["4"] * 4
+        connections = {request["client_address"] for request in StubHandler.requests}
+        assert len(StubHandler.requests) == 16
+        assert len(connections) < len(StubHandler.requests)
+    finally:
+        server.shutdown()
+        server.server_close()
+        client_pool.close()
+        StubHandler.requests.clear()
+
+
+if __name__ == "__main__":
+    test_generate_text_through_pool()
+    test_pool_reuses_connections()
+    print("ok")
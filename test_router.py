@@ -0,0 +1,84 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import Mock, patch
+
+from ai_sdk import generate_text
+
+import src.patch_sdk as _
+from src.client_pool import client_pool
+from src.router import router
+from src.run.model import EndpointConfig
+
+
+def start_stub(name: str, statuses: list[int], hits: list[tuple[str, int, float]]):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            status = statuses.pop(0) if statuses else 200
+            hits.append((name, status, time.monotonic()))
+            if status == 200:
+                payload = {
+                    "id": "stub",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "4"}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                }
+            else:
+                reset = str(int(time.time() * 1000))
+                payload = {"error": {"message": f"stub {status}", "code": status, "metadata": {"headers": {"X-RateLimit-Reset": reset}}}}
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format: str, *args: object):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_failover(order: list[str]):
+    hits: list[tuple[str, int, float]] = []
+    servers = {"A": start_stub("A", [401], hits), "B": start_stub("B", [429], hits)}
+    try:
+        router.configure(
+            [EndpointConfig(name=name, base_url=f"http://127.0.0.1:{servers[name].server_port}/v1", api_key="stub-key") for name in order]
+        )
+        with patch("src.router.random", Mock(choice=lambda states: states[0])):
+            result = generate_text(model=client_pool.get("stub-model", api_key="stub-key"), prompt="What is 2 plus 2?")
+    finally:
+        for server in servers.values():
+            server.shutdown()
+            server.server_close()
+        router.configure([])
+        client_pool.close()
+
+    assert result.text == "4"
+    assert sorted((name, status) for name, status, _ in hits) == [("A", 401), ("B", 200), ("B", 429)]
+    assert hits[-1][:2] == ("B", 200)
+    rate_limited, retried = [at for name, _, at in hits if name == "B"]
+    assert retried - rate_limited >= 0.5
+
+
+def test_failover_then_rate_limit_waits():
+    run_failover(["A", "B"])
+
+
+def test_rate_limit_then_failover_waits():
+    run_failover(["B", "A"])
+
+
+if __name__ == "__main__":
+    test_failover_then_rate_limit_waits()
+    test_rate_limit_then_failover_waits()
+    print("ok")